@@ -1,20 +1,54 @@
 import logging
-from flask import Flask, send_from_directory, request, jsonify, session, send_file
+from flask import Flask, send_from_directory, request, jsonify, session, send_file, Response, stream_with_context
 import os
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from functools import wraps
+from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+from functools import wraps, lru_cache
 from pyutils.user_settings import get_user_settings, save_user_settings
 from pyutils.asset_controller import AssetController
+from pyutils.text_to_speech import generate_voice, generate_voice_stream, tts_cache_stats
+from pyutils.semantic_cache import SemanticCache
+from pyutils.batcher import Batcher
 import re
 import torch
 import json
+import copy
+import hashlib
+import mimetypes
+import shutil
+import threading
+from urllib.parse import quote
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 app = Flask(__name__, static_folder='dist')
 app.secret_key = 'dev_secret_key'  # For session
+# Reject oversized uploads before they consume disk; Live2D model archives
+# with textures run large, so the cap is generous.
+app.config['MAX_CONTENT_LENGTH'] = 512 * 1024 * 1024
+
+if orjson is not None:
+    from flask.json.provider import JSONProvider
+
+    class ORJSONProvider(JSONProvider):
+        """Serialize API JSON with orjson; falls back to stdlib when absent."""
+
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj).decode('utf-8')
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = ORJSONProvider(app)
 
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 
+logger = logging.getLogger(__name__)
+
 # Initialize asset controller for storage (user-uploaded assets)
 STORAGE_PATH = os.path.join(os.path.dirname(__file__), 'storage')
 asset_controller = AssetController(STORAGE_PATH)
@@ -53,19 +87,406 @@ def get_agent_prompt(model_path):
     })
     return agent['system_prompt']
 
-loaded_models = {}
+# Soft VRAM budget for resident chat models; 0 disables eviction. Only one
+# model ships today, but this bounds memory if more are added to CHAT_MODELS.
+CHAT_MODEL_CACHE_MB = int(os.environ.get('CHAT_MODEL_CACHE_MB', '0'))
+
+class _ModelCache:
+    """LRU cache of loaded (tokenizer, model, device) triples.
+
+    Tracks approximate weight bytes per model and evicts the least
+    recently used entry once the budget is exceeded. The most recent
+    entry is never evicted, so a single over-budget model still loads.
+    """
+
+    def __init__(self, budget_mb):
+        self._budget = budget_mb * 1024 * 1024
+        self._entries = OrderedDict()  # model_key -> (entry, weight bytes)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __getitem__(self, key):
+        entry, _ = self._entries[key]
+        self._entries.move_to_end(key)
+        return entry
+
+    def __setitem__(self, key, entry):
+        _, model, _ = entry
+        nbytes = sum(p.numel() * p.element_size() for p in model.parameters())
+        self._entries[key] = (entry, nbytes)
+        self._entries.move_to_end(key)
+        evicted = False
+        if self._budget:
+            while len(self._entries) > 1 and self._total_bytes() > self._budget:
+                evicted_key, _ = self._entries.popitem(last=False)
+                logger.info("Evicting chat model %s (cache over %d MB)",
+                            evicted_key, self._budget // (1024 * 1024))
+                evicted = True
+        if evicted and DEVICE == "cuda":
+            torch.cuda.empty_cache()
+
+    def _total_bytes(self):
+        return sum(nbytes for _, nbytes in self._entries.values())
+
+loaded_models = _ModelCache(CHAT_MODEL_CACHE_MB)
+
+# Strip <think>...</think> blocks the model may emit; compiled once since
+# both the classifier and the reply path run these on every turn.
+_THINK_RE = re.compile(r'<think>.*?</think>', re.DOTALL | re.IGNORECASE)
+_THINK_TAG_RE = re.compile(r'</?think>', re.IGNORECASE)
+# Characters stripped from text before TTS synthesis
+_TTS_CLEAN_RE = re.compile(r'[^\w\s.,!?\-]')
+
+# Probe CUDA availability once; torch.cuda.is_available() is not free and
+# does not change over the process lifetime.
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+# Allow TF32 matmuls on Ampere+; inference only, so the precision trade is fine
+torch.set_float32_matmul_precision('high')
+
+# Opt-in torch.compile of the decoder forward (CHAT_COMPILE=1). First-call
+# compilation takes minutes, so it stays off by default for dev runs; the
+# startup warmup absorbs the cost when enabled.
+CHAT_COMPILE = os.environ.get('CHAT_COMPILE', '0') == '1'
+
+# Opt-in weight-only quantization via torchao (CHAT_QUANT=int8). Decode is
+# memory-bound at batch 1, so halving weight bytes roughly doubles
+# tokens/sec; skipped with a warning when torchao is missing.
+CHAT_QUANT = os.environ.get('CHAT_QUANT', '')
+
+# Chat backend: 'transformers' (default) keeps the in-process generate path;
+# 'vllm' (optional, pip install vllm) serves the same models with
+# PagedAttention, continuous batching and prefix caching for multi-user load.
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'transformers')
+
+# Opt-in X-Accel-Redirect offload (USE_X_ACCEL=1): storage downloads and
+# previews return an internal-redirect header and nginx pumps the bytes,
+# taking Python out of the copy path for multi-MB model files. Requires:
+#     location /internal-storage/ { internal; alias <storage dir>/; }
+USE_X_ACCEL = os.environ.get('USE_X_ACCEL', '0') == '1'
+
+def _send_storage_file(full_path, rel_path, as_attachment=False, max_age=None):
+    """Serve a storage file, delegating the byte pump to nginx when enabled."""
+    if USE_X_ACCEL:
+        resp = Response(status=200)
+        resp.headers['X-Accel-Redirect'] = '/internal-storage/' + quote(rel_path)
+        resp.headers['Content-Type'] = (mimetypes.guess_type(full_path)[0]
+                                        or 'application/octet-stream')
+        if as_attachment:
+            filename = os.path.basename(rel_path)
+            resp.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return resp
+    kwargs = {'conditional': True, 'as_attachment': as_attachment}
+    if max_age is not None:
+        kwargs['max_age'] = max_age
+    return send_file(full_path, **kwargs)
+
+loaded_vllm_engines = {}
+
+def get_vllm_engine(model_key):
+    if model_key not in loaded_vllm_engines:
+        from vllm import LLM
+        model_info = CHAT_MODELS[model_key]
+        loaded_vllm_engines[model_key] = LLM(
+            model=model_info["name"],
+            download_dir=model_info["dir"],
+            enable_prefix_caching=True,
+            max_num_seqs=64,
+            trust_remote_code=True,
+        )
+    return loaded_vllm_engines[model_key]
+
+# Semantic response cache: paraphrased repeats of a recent prompt skip the
+# full decode pass and reuse the cached reply. Opt-in (SEMANTIC_CACHE=1):
+# the mean-pooled embedding is a bag-of-tokens, so near-identical prompts
+# with different meaning ("I like X" / "I don't like X") can clear the
+# threshold and reuse the wrong reply — acceptable for kiosk-style idle
+# chatter, not as a default.
+SEMANTIC_CACHE = os.environ.get('SEMANTIC_CACHE', '0') == '1'
+semantic_cache = SemanticCache(threshold=0.95, max_entries=1024)
+
+# Exact-match response cache: identical chat turns (same prompt and sampling
+# parameters) short-circuit before even the embedding lookup. Lock held for
+# every access — gunicorn serves with threads, and an unlocked eviction
+# racing a lookup would KeyError.
+RESPONSE_CACHE_MAX = 1024
+response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+def response_cache_key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+def response_cache_get(key):
+    with _response_cache_lock:
+        value = response_cache.get(key)
+        if value is not None:
+            response_cache.move_to_end(key)
+        return value
+
+def response_cache_put(key, value):
+    with _response_cache_lock:
+        response_cache[key] = value
+        response_cache.move_to_end(key)
+        while len(response_cache) > RESPONSE_CACHE_MAX:
+            response_cache.popitem(last=False)
+
+def embed_prompt(text, model_key):
+    """Cheap sentence embedding: mean-pooled input embeddings, no forward pass."""
+    tokenizer, model, device = get_chat_model(model_key)
+    input_ids = tokenizer(text, return_tensors="pt", truncation=True, max_length=512).input_ids.to(device)
+    with torch.inference_mode():
+        embedding = model.get_input_embeddings()(input_ids).mean(dim=1).squeeze(0)
+    return embedding.float().cpu().numpy()
+
+_model_load_lock = threading.Lock()
 
 def get_chat_model(model_key):
     if model_key not in loaded_models:
-        model_info = CHAT_MODELS[model_key]
-        tokenizer = AutoTokenizer.from_pretrained(model_info["name"], cache_dir=model_info["dir"], trust_remote_code=True)
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        model = AutoModelForCausalLM.from_pretrained(model_info["name"], cache_dir=model_info["dir"], trust_remote_code=True).to(device)
-        loaded_models[model_key] = (tokenizer, model, device)
+        with _model_load_lock:
+            if model_key not in loaded_models:
+                model_info = CHAT_MODELS[model_key]
+                tokenizer = AutoTokenizer.from_pretrained(model_info["name"], cache_dir=model_info["dir"], trust_remote_code=True)
+                device = DEVICE
+                load_kwargs = {"cache_dir": model_info["dir"], "trust_remote_code": True}
+                if device == "cuda":
+                    # bf16 halves weight memory and roughly doubles decode
+                    # throughput on Ampere+ with no perceptible quality loss.
+                    load_kwargs["torch_dtype"] = torch.bfloat16
+                model = None
+                # Prefer flash-attention kernels, fall back to PyTorch SDPA,
+                # then to whatever the model's default implementation is.
+                for attn in ("flash_attention_2", "sdpa", None):
+                    try:
+                        kwargs = dict(load_kwargs)
+                        if attn is not None:
+                            kwargs["attn_implementation"] = attn
+                        model = AutoModelForCausalLM.from_pretrained(model_info["name"], **kwargs).to(device)
+                        break
+                    except (ImportError, ValueError) as e:
+                        logger.info("attn_implementation=%s unavailable (%s), trying next", attn, e)
+                if model is None:
+                    model = AutoModelForCausalLM.from_pretrained(model_info["name"], cache_dir=model_info["dir"], trust_remote_code=True).to(device)
+                model.eval()
+                if CHAT_QUANT == 'int8':
+                    try:
+                        from torchao.quantization import quantize_, int8_weight_only
+                        quantize_(model, int8_weight_only())
+                    except ImportError:
+                        logger.warning("CHAT_QUANT=int8 requested but torchao is not installed; skipping")
+                if CHAT_COMPILE:
+                    model.forward = torch.compile(model.forward, mode="reduce-overhead", fullgraph=False, dynamic=True)
+                    # Static KV cache gives the compiled decode step fixed
+                    # shapes, so each token becomes a CUDA graph replay
+                    # instead of an eager dispatch. generate refuses an
+                    # explicit past_key_values while this is set, so the
+                    # prefix-KV reuse path is disabled under CHAT_COMPILE.
+                    model.generation_config.cache_implementation = "static"
+                loaded_models[model_key] = (tokenizer, model, device)
     return loaded_models[model_key]
 
-def classify_intent(prompt, model_name):
-    system_prompt = (
+def _has_balanced_json(text):
+    """True once text contains a brace-balanced top-level JSON object."""
+    start = text.find('{')
+    if start == -1:
+        return False
+    depth = 0
+    for ch in text[start:]:
+        if ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                return True
+    return False
+
+class _BalancedJsonStop(StoppingCriteria):
+    """Halt generation once every sequence has emitted a balanced JSON object."""
+
+    def __init__(self, tokenizer, prompt_len):
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+
+    def __call__(self, input_ids, scores, **kwargs):
+        for row in input_ids:
+            text = self.tokenizer.decode(row[self.prompt_len:], skip_special_tokens=True)
+            if not _has_balanced_json(text):
+                return False
+        return True
+
+# Prefilled KV caches for constant system prefixes, keyed by
+# (model key, system prompt). Callers deepcopy before generating since
+# generate mutates the cache in place.
+_prefix_kv_cache = {}
+
+def _get_prefix_kv(model_key, tokenizer, model, device, system_prompt):
+    cache_key = (model_key, system_prompt)
+    entry = _prefix_kv_cache.get(cache_key)
+    if entry is None:
+        prefix_text = tokenizer.apply_chat_template(
+            [{"role": "system", "content": system_prompt}], tokenize=False)
+        prefix_ids = tokenizer(prefix_text, add_special_tokens=False, return_tensors='pt').input_ids.to(device)
+        kv = DynamicCache()
+        with torch.inference_mode():
+            model(prefix_ids, use_cache=True, past_key_values=kv)
+        entry = (prefix_ids.shape[-1], kv)
+        _prefix_kv_cache[cache_key] = entry
+    return entry
+
+def _to_device(tensor, device):
+    """Move a CPU tensor to the target device, via pinned memory on CUDA.
+
+    Pinning lets the H2D copy run async (non_blocking) so it overlaps with
+    whatever the GPU is still finishing instead of stalling the host thread.
+    """
+    if device == "cuda":
+        return tensor.pin_memory().to(device, non_blocking=True)
+    return tensor.to(device)
+
+def _generate_batch_vllm(items):
+    """vLLM executor: the engine batches internally, so submit everything at once."""
+    from vllm import SamplingParams
+    results = [None] * len(items)
+    groups = {}
+    for i, item in enumerate(items):
+        groups.setdefault(item['model'], []).append(i)
+    for model_key, indices in groups.items():
+        engine = get_vllm_engine(model_key)
+        tokenizer = engine.get_tokenizer()
+        prompts = [tokenizer.apply_chat_template(items[i]['messages'], tokenize=False) for i in indices]
+        params = []
+        for i in indices:
+            item = items[i]
+            if item['do_sample']:
+                params.append(SamplingParams(max_tokens=item['max_new_tokens'],
+                                             temperature=item.get('temperature') or 1.0))
+            else:
+                params.append(SamplingParams(max_tokens=item['max_new_tokens'], temperature=0.0))
+        outputs = engine.generate(prompts, params)
+        for i, output in zip(indices, outputs):
+            results[i] = output.outputs[0].text
+    return results
+
+def _generate_batch(items):
+    """Executor for chat_batcher: group compatible requests, one padded generate per group."""
+    if LLM_BACKEND == 'vllm':
+        return _generate_batch_vllm(items)
+    results = [None] * len(items)
+    groups = {}
+    for i, item in enumerate(items):
+        key = (item['model'], item['max_new_tokens'], item['do_sample'], item.get('temperature'),
+               item.get('stop_on_json', False))
+        groups.setdefault(key, []).append(i)
+    for (model_key, max_new_tokens, do_sample, temperature, stop_on_json), indices in groups.items():
+        tokenizer, model, device = get_chat_model(model_key)
+        gen_kwargs = {'max_new_tokens': max_new_tokens, 'do_sample': do_sample}
+        if do_sample and temperature is not None:
+            gen_kwargs['temperature'] = temperature
+        ids_list = [_chat_input_ids(tokenizer, items[i]['messages']) for i in indices]
+        if len(indices) == 1:
+            item = items[indices[0]]
+            input_ids = _to_device(torch.tensor([ids_list[0]], dtype=torch.long), device)
+            prompt_len = input_ids.shape[-1]
+            if stop_on_json:
+                gen_kwargs['stopping_criteria'] = StoppingCriteriaList([_BalancedJsonStop(tokenizer, prompt_len)])
+            messages = item['messages']
+            if not CHAT_COMPILE and len(messages) == 2 and messages[0]['role'] == 'system':
+                # Reuse the prefilled KV cache for the constant system prefix
+                # so prefill only covers the user suffix. Mutually exclusive
+                # with the compiled path's static cache: generate raises if
+                # past_key_values is passed while cache_implementation is set.
+                prefix_len, prefix_kv = _get_prefix_kv(model_key, tokenizer, model, device,
+                                                       messages[0]['content'])
+                if prompt_len > prefix_len:
+                    gen_kwargs['past_key_values'] = copy.deepcopy(prefix_kv)
+            with torch.inference_mode():
+                output = model.generate(input_ids, **gen_kwargs)
+            results[indices[0]] = tokenizer.decode(output[0][prompt_len:], skip_special_tokens=True)
+        else:
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+            tokenizer.padding_side = 'left'
+            encoded = tokenizer.pad({'input_ids': ids_list}, padding=True, return_tensors="pt")
+            encoded = {k: _to_device(v, device) for k, v in encoded.items()}
+            prompt_len = encoded['input_ids'].shape[-1]
+            if stop_on_json:
+                gen_kwargs['stopping_criteria'] = StoppingCriteriaList([_BalancedJsonStop(tokenizer, prompt_len)])
+            with torch.inference_mode():
+                output = model.generate(**encoded, **gen_kwargs)
+            for row, i in enumerate(indices):
+                results[i] = tokenizer.decode(output[row][prompt_len:], skip_special_tokens=True)
+    return results
+
+# Upper edges of the output-length bins; longer generations fall in the last bin
+GENERATION_BINS = (64, 256)
+
+def predict_output_len(item):
+    """Heuristic expected output length, used to pick a batching bin."""
+    max_tokens = item['max_new_tokens']
+    # Greedy turns are intent classifications that emit a short JSON object
+    # well before their token budget; bin them with the short requests.
+    if not item['do_sample']:
+        return min(max_tokens, 64)
+    return max_tokens
+
+def generation_bin(item):
+    predicted = predict_output_len(item)
+    for i, edge in enumerate(GENERATION_BINS):
+        if predicted <= edge:
+            return i
+    return len(GENERATION_BINS)
+
+# Coalesce concurrent chat requests into batched generate calls, binned by
+# expected output length so short requests never wait on long ones
+chat_batcher = Batcher(_generate_batch, max_batch=8, max_wait_ms=10, bin_key=generation_bin)
+
+def generate_chat(messages, model_key, max_new_tokens, do_sample=False, temperature=None, stop_on_json=False):
+    """Run one chat generation through the micro-batching queue."""
+    return chat_batcher.run({
+        'messages': messages,
+        'model': model_key,
+        'max_new_tokens': max_new_tokens,
+        'do_sample': do_sample,
+        'temperature': temperature,
+        'stop_on_json': stop_on_json,
+    })
+
+# Tokenized system-prompt prefixes, keyed by (tokenizer id, prompt). The
+# classifier prompt alone is ~40 lines of few-shot examples; re-tokenizing
+# it per request is pure waste since it never changes.
+_prefix_ids_cache = {}
+
+def build_chat_input_ids(tokenizer, system_prompt, user_prompt):
+    """Token ids for a (system, user) turn, reusing cached ids for the
+    constant system prefix so only the user suffix is tokenized per call."""
+    cache_key = (id(tokenizer), system_prompt)
+    system_msg = [{"role": "system", "content": system_prompt}]
+    cached = _prefix_ids_cache.get(cache_key)
+    if cached is None:
+        prefix_text = tokenizer.apply_chat_template(system_msg, tokenize=False)
+        prefix_ids = tokenizer(prefix_text, add_special_tokens=False).input_ids
+        cached = (prefix_text, prefix_ids)
+        _prefix_ids_cache[cache_key] = cached
+    prefix_text, prefix_ids = cached
+    full_text = tokenizer.apply_chat_template(
+        system_msg + [{"role": "user", "content": user_prompt}], tokenize=False)
+    if full_text.startswith(prefix_text):
+        suffix_ids = tokenizer(full_text[len(prefix_text):], add_special_tokens=False).input_ids
+        return prefix_ids + suffix_ids
+    # Template did not render the system turn as a literal prefix; tokenize whole
+    return tokenizer(full_text, add_special_tokens=False).input_ids
+
+def _chat_input_ids(tokenizer, messages):
+    if len(messages) == 2 and messages[0]['role'] == 'system' and messages[1]['role'] == 'user':
+        return build_chat_input_ids(tokenizer, messages[0]['content'], messages[1]['content'])
+    text = tokenizer.apply_chat_template(messages, tokenize=False)
+    return tokenizer(text, add_special_tokens=False).input_ids
+
+INTENT_SYSTEM_PROMPT = (
         "You are an intent classifier for an AI agent. "
         "Given a user message, reply ONLY with a JSON object: "
         '{"intent": "list-assets"|"search-assets"|"delete-asset"|"rename-asset"|"download-asset"|"normal-chat", "args": {...}}. '
@@ -116,29 +537,158 @@ def classify_intent(prompt, model_name):
         'Reply: {"intent": "normal-chat", "args": {}}\n'
         "User: 'Can you help me?'\n"
         'Reply: {"intent": "normal-chat", "args": {}}\n'
-    )
+)
+
+@lru_cache(maxsize=512)
+def classify_intent(prompt, model_name):
+    # Greedy decode is deterministic, so repeated prompts can reuse the result
     messages = [
-        {"role": "system", "content": system_prompt},
+        {"role": "system", "content": INTENT_SYSTEM_PROMPT},
         {"role": "user", "content": prompt}
     ]
+    # The expected output is a ~20-token JSON object; 32 tokens of budget
+    # plus the balanced-brace stop keeps decode steps to a minimum.
+    response = generate_chat(messages, model_name, max_new_tokens=32, do_sample=False, stop_on_json=True)
+    return _strip_think(response).strip()
+
+def _extract_json(text):
+    """Return the first balanced top-level JSON object in text, or None."""
+    start = text.find('{')
+    if start == -1:
+        return None
+    depth = 0
+    for i in range(start, len(text)):
+        ch = text[i]
+        if ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+def combined_intent_prompt(system_prompt):
+    """System prompt for a single decode that yields both the routing
+    decision and, for normal chat, the reply itself."""
+    return (
+        f"{system_prompt}\n\n"
+        "Before responding, decide whether the user is asking you to manage "
+        "their uploaded assets. Reply ONLY with one JSON object of the form "
+        '{"intent": ..., "args": {...}, "reply": "..."}.\n'
+        "Valid intents and args:\n"
+        '- {"intent": "list-assets", "args": {}}\n'
+        '- {"intent": "search-assets", "args": {"query": ..., "type": ..., "ext": ..., "min_size_mb": ..., "date": ...}} (any subset)\n'
+        '- {"intent": "delete-asset", "args": {"path": ...}}\n'
+        '- {"intent": "rename-asset", "args": {"old_path": ..., "new_path": ...}}\n'
+        '- {"intent": "download-asset", "args": {"path": ...}}\n'
+        '- {"intent": "normal-chat", "args": {}}\n'
+        'For asset intents leave "reply" as an empty string. For normal-chat, '
+        'write your full in-character answer in "reply".'
+    )
+
+def _strip_think(text):
+    """Remove <think> blocks from a complete reply.
+
+    The find checks make the common tag-free case a pair of scans with no
+    regex work; '</think' is tested separately since the model sometimes
+    emits a closing tag with no opener.
+    """
+    if '<think' in text or '</think' in text:
+        text = _THINK_RE.sub('', text)
+        text = _THINK_TAG_RE.sub('', text)
+    return text
+
+def _visible_text(raw):
+    """Strip closed <think> blocks and truncate at any still-open one."""
+    if '<think' not in raw and '</think' not in raw:
+        return raw
+    text = _THINK_RE.sub('', raw)
+    cut = text.find('<think')
+    if cut != -1:
+        text = text[:cut]
+    return _THINK_TAG_RE.sub('', text)
+
+def stream_chat_sse(messages, model_name):
+    """Yield SSE events with reply tokens as they come off the model.
+
+    Generation runs on its own thread (bypassing the batcher: a streamed
+    request owns its decode) while this generator forwards tokens. A small
+    tail is held back so a partially-emitted <think> tag never leaks.
+    """
     tokenizer, model, device = get_chat_model(model_name)
-    input_ids = tokenizer.apply_chat_template(messages, return_tensors="pt").to(device)
-    output = model.generate(input_ids, max_new_tokens=128, do_sample=False)
-    response = tokenizer.decode(output[0][input_ids.shape[-1]:], skip_special_tokens=True)
-    response = re.sub(r'<think>.*?</think>', '', response, flags=re.DOTALL | re.IGNORECASE)
-    response = re.sub(r'</?think>', '', response, flags=re.IGNORECASE)
-    return response.strip()
-
-# Preload the default model at startup (only in main process, not reloader)
-if __name__ == "__main__" or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    input_ids = _to_device(torch.tensor([_chat_input_ids(tokenizer, messages)], dtype=torch.long), device)
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+    def _run():
+        with torch.inference_mode():
+            model.generate(input_ids, max_new_tokens=256, do_sample=True, temperature=0.7, streamer=streamer)
+
+    threading.Thread(target=_run, daemon=True).start()
+    buffer = ''
+    emitted = 0
+    for token in streamer:
+        buffer += token
+        visible = _visible_text(buffer)
+        # Hold back a few chars in case a '<think' tag is split across tokens
+        safe_len = max(emitted, len(visible) - 8)
+        if safe_len > emitted:
+            yield f"data: {json.dumps({'token': visible[emitted:safe_len]})}\n\n"
+            emitted = safe_len
+    visible = _visible_text(buffer)
+    if len(visible) > emitted:
+        yield f"data: {json.dumps({'token': visible[emitted:]})}\n\n"
+    yield "data: [DONE]\n\n"
+
+def warmup_chat_model(model_key):
+    """Run a tiny generation so the first real request does not pay the
+    cuDNN/cuBLAS autotune and allocator warmup cost."""
     try:
-        print("Preloading chat model...")
-        get_chat_model('Qwen3-1.7B')
-        print("Model loaded successfully.")
+        generate_chat([{"role": "user", "content": "Hi"}], model_key, max_new_tokens=2)
     except Exception as e:
-        import traceback
-        print("Model preload failed:")
-        print(traceback.format_exc())
+        logger.warning("Chat model warmup failed: %s", e)
+
+def _prewarm_prefixes(model_key):
+    """Tokenize and prefill KV for every constant system prefix.
+
+    /api/chat derives its system prompt from the model's HF name via
+    get_agent_prompt, so that prompt (plain and combined) plus the intent
+    prompt are what every turn actually uses; warming them at startup
+    means the first request skips both tokenization and prefix prefill.
+    """
+    tokenizer, model, device = get_chat_model(model_key)
+    prompts = [INTENT_SYSTEM_PROMPT]
+    chat_prompt = get_agent_prompt(CHAT_MODELS[model_key]['name'])
+    prompts.append(chat_prompt)
+    prompts.append(combined_intent_prompt(chat_prompt))
+    for system_prompt in prompts:
+        build_chat_input_ids(tokenizer, system_prompt, "")
+        if not CHAT_COMPILE:
+            # Prefix-KV reuse is off under CHAT_COMPILE (static cache), so
+            # prefilling would be wasted work.
+            _get_prefix_kv(model_key, tokenizer, model, device, system_prompt)
+
+def _preload_models():
+    try:
+        logger.info("Preloading chat model...")
+        if LLM_BACKEND == 'vllm':
+            get_vllm_engine('Qwen3-1.7B')
+        else:
+            get_chat_model('Qwen3-1.7B')
+        warmup_chat_model('Qwen3-1.7B')
+        if LLM_BACKEND == 'transformers':
+            _prewarm_prefixes('Qwen3-1.7B')
+        logger.info("Model loaded successfully.")
+    except Exception:
+        logger.exception("Model preload failed")
+
+# Preload the default model at startup. The load runs on a background
+# thread so the server can bind its port and answer health checks while
+# weights stream in; get_chat_model's load lock keeps an early request
+# from racing the preload. Under the Werkzeug reloader this branch fires
+# only in the serving child — the supervisor process imports this module
+# too but never handles requests, and must not load a second model copy.
+if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    threading.Thread(target=_preload_models, daemon=True).start()
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
@@ -146,16 +696,93 @@ def chat():
         data = request.json
         prompt = data.get('prompt', '')
         model_name = data.get('model', 'Qwen3-1.7B')
+        stream = bool(data.get('stream'))
 
-        # Step 1: Classify intent
-        intent_json = classify_intent(prompt, model_name)
-        try:
-            intent_data = json.loads(intent_json)
-        except Exception:
-            intent_data = {"intent": "normal-chat", "args": {}}
+        model_info = CHAT_MODELS.get(model_name)
+        if not model_info:
+            return jsonify({'error': 'Invalid model name'}), 400
+        system_prompt = get_agent_prompt(model_info['name'])
+
+        # Cached replies are always normal-chat, so a hit short-circuits
+        # before any model call — including intent classification.
+        cache_key = response_cache_key(system_prompt, prompt, model_name, 256, 0.7)
+        query_embedding = None
+        if not stream:
+            cached_response = response_cache_get(cache_key)
+            if cached_response is not None:
+                return jsonify({"response": cached_response})
+            if SEMANTIC_CACHE and LLM_BACKEND == 'transformers':
+                # Embeddings come from the transformers model's input-embedding
+                # table; vLLM keeps weights inside the engine, so the semantic
+                # tier is skipped there and only the exact cache applies.
+                # Only the user prompt is embedded — including the constant
+                # persona prefix would dominate the mean and push every
+                # prompt pair over the similarity threshold.
+                query_embedding = embed_prompt(prompt, model_name)
+                cached_response = semantic_cache.get(query_embedding)
+                if cached_response is not None:
+                    return jsonify({"response": cached_response})
+
+        # A single decode yields both the routing decision and, for normal
+        # chat, the reply — one model call per turn instead of two. Streamed
+        # requests keep the cheap greedy classifier since their reply is
+        # produced token-by-token afterwards.
+        merged_reply = None
+        intent_data = None
+        intent_sampled = False
+        if stream:
+            intent_json = classify_intent(prompt, model_name)
+            try:
+                intent_data = json.loads(intent_json)
+            except Exception:
+                intent_data = {"intent": "normal-chat", "args": {}}
+        else:
+            combined_messages = [
+                {"role": "system", "content": combined_intent_prompt(system_prompt)},
+                {"role": "user", "content": prompt}
+            ]
+            raw = generate_chat(combined_messages, model_name, max_new_tokens=320,
+                                do_sample=True, temperature=0.7, stop_on_json=True)
+            fragment = _extract_json(_visible_text(raw))
+            if fragment:
+                try:
+                    intent_data = json.loads(fragment)
+                except Exception:
+                    intent_data = None
+            if intent_data is None:
+                # Malformed combined output: fall back to the two-step path.
+                intent_json = classify_intent(prompt, model_name)
+                try:
+                    intent_data = json.loads(intent_json)
+                except Exception:
+                    intent_data = {"intent": "normal-chat", "args": {}}
+            else:
+                intent_sampled = True
+                reply = intent_data.get("reply")
+                if isinstance(reply, str):
+                    merged_reply = reply.strip() or None
 
         intent = intent_data.get("intent", "normal-chat")
         args = intent_data.get("args", {})
+        if not isinstance(args, dict):
+            args = {}
+
+        if intent_sampled and intent in ("delete-asset", "rename-asset"):
+            # The combined decode samples at temperature 0.7, which must not
+            # be what pulls the trigger on a destructive action: re-check
+            # with the deterministic greedy classifier and act on its
+            # verdict — intent and args both, so a sampled hallucinated
+            # path can't slip through under an agreeing intent.
+            try:
+                confirm = json.loads(classify_intent(prompt, model_name))
+            except Exception:
+                confirm = {}
+            if confirm.get("intent") != intent:
+                merged_reply = None
+            intent = confirm.get("intent", "normal-chat")
+            args = confirm.get("args", {})
+            if not isinstance(args, dict):
+                args = {}
 
         # Step 2: Route based on intent
         if intent == "list-assets":
@@ -235,24 +862,28 @@ def chat():
             return jsonify({"type": "asset-list", "assets": asset_objs})
         else:
             # Normal chat
-            model_info = CHAT_MODELS.get(model_name)
-            if not model_info:
-                return jsonify({'error': 'Invalid model name'}), 400
-            system_prompt = get_agent_prompt(model_info['name'])
             messages = [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt}
             ]
-            tokenizer, model, device = get_chat_model(model_name)
-            input_ids = tokenizer.apply_chat_template(messages, return_tensors="pt").to(device)
-            output = model.generate(input_ids, max_new_tokens=256, do_sample=True, temperature=0.7)
-            response = tokenizer.decode(output[0][input_ids.shape[-1]:], skip_special_tokens=True)
-            response = re.sub(r'<think>.*?</think>', '', response, flags=re.DOTALL | re.IGNORECASE)
-            response = re.sub(r'</?think>', '', response, flags=re.IGNORECASE)
-            return jsonify({"response": response.strip()})
+            if stream:
+                # Token-by-token SSE: first token reaches the client after one
+                # decode step instead of after the full generation. Streamed
+                # replies skip the response caches.
+                return Response(stream_with_context(stream_chat_sse(messages, model_name)),
+                                mimetype='text/event-stream')
+            response = merged_reply
+            if response is None:
+                # Combined decode produced no usable reply; generate one with
+                # the plain persona prompt.
+                response = generate_chat(messages, model_name, max_new_tokens=256, do_sample=True, temperature=0.7)
+                response = _strip_think(response).strip()
+            response_cache_put(cache_key, response)
+            if query_embedding is not None:
+                semantic_cache.add(query_embedding, response)
+            return jsonify({"response": response})
     except Exception as e:
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("Unhandled error in /api/chat")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/')
@@ -262,32 +893,57 @@ def index():
 
 @app.route('/<path:path>')
 def static_proxy(path):
-    # Serve static files from dist (React build output)
-    return send_from_directory('dist', path)
+    # Serve static files from dist (React build output). send_from_directory
+    # answers conditional GETs (ETag/If-Modified-Since -> 304) by default;
+    # max_age lets browsers skip even the revalidation round trip.
+    return send_from_directory('dist', path, max_age=3600)
 
 @app.route('/assets/<path:path>')
 def serve_static(path):
-    return send_from_directory('./dist/assets', path)
+    # Vite emits content-hashed filenames here, so they can be cached hard.
+    return send_from_directory('./dist/assets', path, max_age=31536000)
 
 @app.route('/api/tts', methods=['POST'])
 def tts_api():
     data = request.json
     text = data.get('text', '')
     # Remove special characters for TTS
-    text = re.sub(r'[^\w\s.,!?\-]', '', text)
+    text = _TTS_CLEAN_RE.sub('', text)
     pitch = float(data.get('pitch', 1.0))
     speed = float(data.get('speed', 1.0))
+    if pitch <= 0 or speed <= 0:
+        return jsonify({'error': 'TTS failed', 'details': 'pitch and speed must be positive'}), 400
+    if not text.strip():
+        return jsonify({'error': 'TTS failed', 'details': 'No text to synthesize'}), 400
     voice = data.get('voice', '')
     gender = data.get('gender', '')
     mood = data.get('mood', '')
     try:
-        from pyutils.text_to_speech import generate_voice
+        if pitch == 1.0 and speed == 1.0:
+            # No post-processing needed: stream mp3 chunks as they are
+            # synthesized instead of buffering the whole clip first. The
+            # first chunk is pulled eagerly so a gTTS failure surfaces here,
+            # inside this try, rather than mid-stream after the 200 is sent.
+            chunks = generate_voice_stream(text, voice=voice)
+            first = next(chunks, None)
+            if first is None:
+                return jsonify({'error': 'TTS failed', 'details': 'No audio produced'}), 500
+
+            def _replay():
+                yield first
+                yield from chunks
+
+            return Response(stream_with_context(_replay()), mimetype='audio/mpeg')
         audio_fp = generate_voice(text, pitch=pitch, speed=speed, voice=voice, gender=gender, mood=mood)
         return send_file(audio_fp, mimetype='audio/mpeg', as_attachment=False, download_name='tts.mp3')
     except Exception as e:
-        print(f"TTS error: {e}")
+        logger.error("TTS error: %s", e)
         return jsonify({'error': 'TTS failed', 'details': str(e)}), 500
 
+@app.route('/api/tts/cache/stats')
+def tts_cache_stats_api():
+    return jsonify(tts_cache_stats())
+
 # --- Simple Auth Decorator ---
 def login_required(f):
     @wraps(f)
@@ -328,6 +984,11 @@ def tts_settings():
 def list_assets():
     try:
         directory = request.args.get('directory', '')
+        if request.args.get('detail') == '1':
+            # Columnar shape: one response with parallel arrays instead of a
+            # follow-up stat request per file.
+            names, sizes, mtimes = asset_controller.list_assets_detailed(directory)
+            return jsonify({'names': names, 'sizes': sizes, 'mtimes': mtimes})
         assets = asset_controller.list_assets(directory)
         return jsonify(assets)
     except Exception as e:
@@ -380,23 +1041,32 @@ def download_asset():
             if not os.path.exists(full_path):
                 return jsonify({'error': 'File not found'}), 404
                 
-            return send_file(full_path, as_attachment=True)
+            return _send_storage_file(full_path, path, as_attachment=True)
         else:
-            # Multiple files - create zip
-            result = asset_controller.create_download_zip(paths)
-            if not result:
-                return jsonify({'error': 'Failed to create zip'}), 500
-                
-            memory_file, size = result
-            return send_file(
-                memory_file,
+            # Multiple files - stream a zip
+            return Response(
+                stream_with_context(asset_controller.iter_download_zip(paths)),
                 mimetype='application/zip',
-                as_attachment=True,
-                download_name='assets.zip'
+                headers={'Content-Disposition': 'attachment; filename=assets.zip'}
             )
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/assets/download-zip', methods=['POST'])
+def download_assets_zip():
+    try:
+        data = request.json
+        paths = data.get('paths') or []
+        if not paths:
+            return jsonify({'error': 'No paths provided'}), 400
+        return Response(
+            stream_with_context(asset_controller.iter_download_zip(paths)),
+            mimetype='application/zip',
+            headers={'Content-Disposition': 'attachment; filename=assets.zip'}
+        )
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/assets/upload', methods=['POST'])
 @login_required
 def upload_asset():
@@ -406,7 +1076,11 @@ def upload_asset():
     if file.filename == '':
         return 'No selected file', 400
     save_path = os.path.join(STORAGE_PATH, file.filename)
-    file.save(save_path)
+    # 1 MB copy buffer: multi-MB texture uploads spend far fewer Python-level
+    # read/write iterations than file.save's default small buffer.
+    with open(save_path, 'wb') as out:
+        shutil.copyfileobj(file.stream, out, length=1 << 20)
+    asset_controller.invalidate_cache()
     return 'Uploaded', 200
 
 @app.route('/api/assets/preview')
@@ -426,17 +1100,31 @@ def preview_asset():
         asset_type = asset_controller.get_asset_type(path)
         
         if asset_type in ['image', 'audio']:
-            return send_file(full_path)
+            # conditional=True serves 304s on repeat fetches; a short max_age
+            # saves the round trip entirely for previews opened in bursts.
+            return _send_storage_file(full_path, path, max_age=300)
         else:
-            # For text-based files, return content
+            # For text-based files, return content. A content ETag lets
+            # repeat previews of unchanged files answer with an empty 304
+            # instead of re-reading and re-encoding the body.
             try:
-                with open(full_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                return jsonify({'content': content})
+                with open(full_path, 'rb') as f:
+                    raw = f.read()
+                etag = hashlib.md5(raw).hexdigest()
+                if etag in request.if_none_match:
+                    return '', 304
+                resp = jsonify({'content': raw.decode('utf-8')})
+                resp.set_etag(etag)
+                return resp
             except Exception:
                 return jsonify({'error': 'Cannot preview file'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(debug=False, port=5000)
\ No newline at end of file
+    debug = os.environ.get('FLASK_DEBUG') == '1'
+    # Without the reloader no child process exists, so preload here; with
+    # it, the WERKZEUG_RUN_MAIN branch above preloads in the serving child.
+    if not debug:
+        threading.Thread(target=_preload_models, daemon=True).start()
+    app.run(debug=debug, port=5000)
\ No newline at end of file
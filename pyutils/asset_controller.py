@@ -1,17 +1,62 @@
 import os
 import shutil
+import threading
+import time
 import zipfile
-import io
-from typing import List, Tuple, Optional
+from typing import Iterator, List
+
+class _StreamBuffer:
+    """Unseekable write sink for ZipFile that a generator can drain in chunks."""
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def seekable(self):
+        return False
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+# Cached listings are reused for this long before the tree is rescanned.
+# The asset-manager UI polls the list endpoint, so even a short window
+# collapses most scans; it also bounds staleness from writes that bypass
+# this controller (nested changes don't bump the base dir's mtime).
+LIST_CACHE_TTL = 2.0  # seconds
 
 class AssetController:
     def __init__(self, base_path: str):
         self.base_path = base_path
-        
+        self._real_base = os.path.realpath(base_path)
+        # directory -> (timestamp, base dir mtime_ns, sorted assets). The
+        # mtime check catches direct changes to the listed directory;
+        # writes that go through this controller (or the upload handler)
+        # also call invalidate_cache().
+        self._list_cache = {}
+        self._list_cache_lock = threading.Lock()
+
     def _get_full_path(self, relative_path: str) -> str:
-        """Convert relative path to full path and validate it's within base_path"""
-        full_path = os.path.abspath(os.path.join(self.base_path, relative_path))
-        if not full_path.startswith(self.base_path):
+        """Convert relative path to full path and validate it's within base_path.
+
+        realpath + commonpath containment replaces the old startswith
+        prefix check, which both let a sibling directory like
+        "<base>2/file" through and could be escaped via symlinks.
+        """
+        full_path = os.path.realpath(os.path.join(self._real_base, relative_path))
+        if os.path.commonpath([full_path, self._real_base]) != self._real_base:
             raise ValueError("Invalid path: Attempting to access outside base directory")
         return full_path
         
@@ -20,20 +65,103 @@ class AssetController:
         full_path = self._get_full_path(directory)
         if not os.path.exists(full_path):
             return []
-            
-        assets = []
-        for root, _, files in os.walk(full_path):
-            for file in files:
-                rel_path = os.path.relpath(os.path.join(root, file), self.base_path)
-                assets.append(rel_path.replace("\\", "/"))
-        return sorted(assets)
-        
+
+        try:
+            mtime = os.stat(full_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        now = time.monotonic()
+        with self._list_cache_lock:
+            cached = self._list_cache.get(directory)
+            if (cached is not None and mtime is not None
+                    and now - cached[0] <= LIST_CACHE_TTL and cached[1] == mtime):
+                return cached[2]
+
+        assets = sorted(self._scan(full_path))
+        if mtime is not None:
+            with self._list_cache_lock:
+                self._list_cache[directory] = (now, mtime, assets)
+        return assets
+
+    def list_assets_detailed(self, directory: str = ""):
+        """Listing with sizes and mtimes as parallel (columnar) lists.
+
+        Stats come from the scandir DirEntry, which already holds them from
+        the directory read on Linux — no per-file syscall. One response
+        with three arrays spares the client a follow-up request per file.
+        """
+        full_path = self._get_full_path(directory)
+        if not os.path.exists(full_path):
+            return [], [], []
+
+        try:
+            mtime = os.stat(full_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        now = time.monotonic()
+        cache_key = ('detail', directory)
+        with self._list_cache_lock:
+            cached = self._list_cache.get(cache_key)
+            if (cached is not None and mtime is not None
+                    and now - cached[0] <= LIST_CACHE_TTL and cached[1] == mtime):
+                return cached[2]
+
+        rows = sorted(self._scan_detailed(full_path))
+        names = [row[0] for row in rows]
+        sizes = [row[1] for row in rows]
+        mtimes = [row[2] for row in rows]
+        result = (names, sizes, mtimes)
+        if mtime is not None:
+            with self._list_cache_lock:
+                self._list_cache[cache_key] = (now, mtime, result)
+        return result
+
+    def _scan_detailed(self, path: str):
+        """Like _scan but yields (relative path, size, mtime) tuples."""
+        try:
+            entries = os.scandir(path)
+        except OSError:
+            return
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self._scan_detailed(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    rel_path = os.path.relpath(entry.path, self.base_path)
+                    stat = entry.stat(follow_symlinks=False)
+                    yield rel_path.replace("\\", "/"), stat.st_size, int(stat.st_mtime)
+
+    def _scan(self, path: str) -> Iterator[str]:
+        """Recursively yield base-relative file paths using os.scandir.
+
+        scandir returns each entry's type from the directory read itself,
+        so the walk costs one syscall per directory instead of a stat per
+        file like os.walk.
+        """
+        try:
+            entries = os.scandir(path)
+        except OSError:
+            return
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self._scan(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    rel_path = os.path.relpath(entry.path, self.base_path)
+                    yield rel_path.replace("\\", "/")
+
+    def invalidate_cache(self) -> None:
+        """Drop cached directory listings; call after any asset mutation."""
+        with self._list_cache_lock:
+            self._list_cache.clear()
+
     def delete_asset(self, asset_path: str) -> bool:
         """Delete an asset file"""
         try:
             full_path = self._get_full_path(asset_path)
             if os.path.exists(full_path):
                 os.remove(full_path)
+                self.invalidate_cache()
                 return True
             return False
         except Exception:
@@ -50,26 +178,45 @@ class AssetController:
                 
             os.makedirs(os.path.dirname(new_full), exist_ok=True)
             shutil.move(old_full, new_full)
+            self.invalidate_cache()
             return True
         except Exception:
             return False
             
-    def create_download_zip(self, asset_paths: List[str]) -> Optional[Tuple[io.BytesIO, int]]:
-        """Create a zip file containing the requested assets"""
-        try:
-            memory_file = io.BytesIO()
-            with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-                for asset_path in asset_paths:
+    # Formats with their own compression; deflating them again burns CPU
+    # for a ~0% size win, so they are stored as-is in download archives.
+    _PRECOMPRESSED_EXTS = frozenset([
+        '.png', '.jpg', '.jpeg', '.gif', '.webp', '.mp3', '.ogg', '.zip', '.gz',
+    ])
+
+    def iter_download_zip(self, asset_paths: List[str]) -> Iterator[bytes]:
+        """Yield zip-archive bytes incrementally for the requested assets.
+
+        Streaming keeps peak memory at one file's compressed size and lets
+        the first bytes reach the client while later files are still being
+        compressed. Invalid or missing paths are skipped.
+        """
+        buffer = _StreamBuffer()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for asset_path in asset_paths:
+                try:
                     full_path = self._get_full_path(asset_path)
-                    if os.path.exists(full_path):
-                        zf.write(full_path, asset_path)
-            
-            memory_file.seek(0)
-            size = memory_file.getbuffer().nbytes
-            return memory_file, size
-        except Exception:
-            return None
-            
+                except ValueError:
+                    continue
+                if not os.path.exists(full_path):
+                    continue
+                ext = os.path.splitext(asset_path)[1].lower()
+                compress = (zipfile.ZIP_STORED if ext in self._PRECOMPRESSED_EXTS
+                            else zipfile.ZIP_DEFLATED)
+                zf.write(full_path, asset_path, compress_type=compress)
+                chunk = buffer.drain()
+                if chunk:
+                    yield chunk
+        chunk = buffer.drain()
+        if chunk:
+            yield chunk
+
+
     def get_asset_type(self, asset_path: str) -> str:
         """Determine the type of asset based on file extension"""
         ext = os.path.splitext(asset_path)[1].lower()
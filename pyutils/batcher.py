@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, List, Optional
+
+class _Pending:
+    __slots__ = ('payload', 'event', 'result', 'error')
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class Batcher:
+    """Coalesce concurrent requests into batches handled by one executor call.
+
+    Callers block in run() while a background worker collects requests that
+    arrive within a small window (max_wait_ms) up to max_batch, passes the
+    payloads to the executor in one call, and distributes the results.
+
+    An optional bin_key maps each payload to a bin id; batches are then only
+    formed within one bin, so short requests never idle behind long ones
+    (multi-bin batching). A bin is dispatched as soon as it is full or its
+    oldest request has waited past the window.
+    """
+
+    def __init__(self, executor: Callable[[List[Any]], List[Any]], max_batch: int = 8,
+                 max_wait_ms: int = 10, bin_key: Optional[Callable[[Any], int]] = None):
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.bin_key = bin_key
+        self._bins = {}  # bin id -> deque of (_Pending, arrival timestamp)
+        self._cond = threading.Condition()
+        self._worker = threading.Thread(target=self._loop, daemon=True)
+        self._worker.start()
+
+    def run(self, payload):
+        """Submit a payload and block until its result is available."""
+        pending = _Pending(payload)
+        bin_id = self.bin_key(payload) if self.bin_key is not None else 0
+        with self._cond:
+            self._bins.setdefault(bin_id, deque()).append((pending, time.monotonic()))
+            self._cond.notify()
+        pending.event.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _collect(self) -> List[_Pending]:
+        window = self.max_wait_ms / 1000.0
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                ready = None
+                oldest = None
+                for bin_id, pending_bin in self._bins.items():
+                    if not pending_bin:
+                        continue
+                    if len(pending_bin) >= self.max_batch:
+                        ready = bin_id
+                        break
+                    head_ts = pending_bin[0][1]
+                    if oldest is None or head_ts < oldest[1]:
+                        oldest = (bin_id, head_ts)
+                if ready is None and oldest is not None and now - oldest[1] >= window:
+                    ready = oldest[0]
+                if ready is not None:
+                    pending_bin = self._bins[ready]
+                    count = min(self.max_batch, len(pending_bin))
+                    return [pending_bin.popleft()[0] for _ in range(count)]
+                if oldest is None:
+                    self._cond.wait()
+                else:
+                    self._cond.wait(timeout=max(0.0, oldest[1] + window - now))
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = self.executor([pending.payload for pending in batch])
+                for pending, result in zip(batch, results):
+                    pending.result = result
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+            for pending in batch:
+                pending.event.set()
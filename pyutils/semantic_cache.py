@@ -0,0 +1,60 @@
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+class SemanticCache:
+    """LRU cache of (sentence embedding -> response) with cosine-similarity lookup.
+
+    Embeddings are L2-normalized float32 vectors kept in one (N, D) matrix so a
+    lookup is a single matrix-vector product instead of a Python loop.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1024):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._embeddings: List[np.ndarray] = []  # LRU order: oldest first
+        self._responses: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(embedding)
+        if norm > 0:
+            embedding = embedding / norm
+        return embedding
+
+    def get(self, embedding: np.ndarray) -> Optional[str]:
+        """Return the cached response most similar to the embedding, or None."""
+        query = self._normalize(embedding)
+        with self._lock:
+            if self._matrix is None:
+                return None
+            sims = self._matrix @ query
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                return None
+            # Move the hit to most-recently-used position
+            self._embeddings.append(self._embeddings.pop(best))
+            self._responses.append(self._responses.pop(best))
+            self._matrix = np.stack(self._embeddings)
+            return self._responses[-1]
+
+    def add(self, embedding: np.ndarray, response: str) -> None:
+        """Store a response under the given embedding, evicting the LRU entry if full."""
+        entry = self._normalize(embedding)
+        with self._lock:
+            self._embeddings.append(entry)
+            self._responses.append(response)
+            if len(self._embeddings) > self.max_entries:
+                self._embeddings.pop(0)
+                self._responses.pop(0)
+            self._matrix = np.stack(self._embeddings)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._embeddings = []
+            self._responses = []
+            self._matrix = None
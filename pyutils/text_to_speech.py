@@ -3,51 +3,237 @@ import librosa
 from pydub import AudioSegment
 from io import BytesIO
 import soundfile as sf
-import tempfile
+import hashlib
 import os
+import subprocess
+import threading
+import time
+from collections import OrderedDict
 
-def generate_voice(text, pitch=1.0, speed=1.0, voice='', gender='', mood=''):
-    # Map common extended codes to gTTS-compatible codes
-    lang_map = {
-        'ja-JP': 'ja',
-        'en-US': 'en',
-        'en-GB': 'en',
-        'zh-CN': 'zh-CN',
-        'zh': 'zh-CN',
-    }
-    lang = lang_map.get(voice, voice) if voice else "ja"
-    tts_fp = BytesIO()
+# In-memory TTL+LRU cache of synthesized mp3 bytes. Greetings and stock
+# phrases recur constantly for a Live2D agent; a hit skips synthesis (and the
+# gTTS network round-trip) entirely. Long texts are not cached.
+TTS_CACHE_MAX = 512
+TTS_CACHE_TTL = 3600  # seconds
+TTS_CACHE_MAX_TEXT_LEN = 256
+_tts_cache = OrderedDict()  # key -> (timestamp, mp3 bytes)
+_tts_cache_lock = threading.Lock()
+_tts_cache_hits = 0
+_tts_cache_misses = 0
+
+# Disk tier below the in-memory cache: clips survive restarts and the LRU
+# eviction above. Lives outside storage/ so it never shows up in asset
+# listings. No TTL — synthesized speech for a given text never goes stale.
+TTS_DISK_CACHE_DIR = os.environ.get(
+    'TTS_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'tts'))
+
+def _tts_cache_key(text, lang, pitch, speed):
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+    return (digest, lang, round(pitch, 2), round(speed, 2))
+
+def _disk_path(key):
+    digest, lang, pitch, speed = key
+    return os.path.join(TTS_DISK_CACHE_DIR, f"{digest}_{lang}_{pitch}_{speed}.mp3")
+
+def _disk_get(key):
+    try:
+        with open(_disk_path(key), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+def _disk_put(key, data):
+    try:
+        os.makedirs(TTS_DISK_CACHE_DIR, exist_ok=True)
+        path = _disk_path(key)
+        tmp = f"{path}.tmp.{os.getpid()}"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)  # atomic: readers never see a partial file
+    except OSError:
+        pass  # cache write failure is not an error
+
+def _tts_cache_get(key):
+    global _tts_cache_hits, _tts_cache_misses
+    with _tts_cache_lock:
+        entry = _tts_cache.get(key)
+        if entry is not None and time.time() - entry[0] <= TTS_CACHE_TTL:
+            _tts_cache.move_to_end(key)
+            _tts_cache_hits += 1
+            return entry[1]
+        if entry is not None:
+            del _tts_cache[key]
+    data = _disk_get(key)
+    with _tts_cache_lock:
+        if data is not None:
+            # Promote to memory without re-writing disk
+            _tts_cache[key] = (time.time(), data)
+            _tts_cache.move_to_end(key)
+            while len(_tts_cache) > TTS_CACHE_MAX:
+                _tts_cache.popitem(last=False)
+            _tts_cache_hits += 1
+            return data
+        _tts_cache_misses += 1
+        return None
+
+def _tts_cache_put(key, data):
+    with _tts_cache_lock:
+        _tts_cache[key] = (time.time(), data)
+        _tts_cache.move_to_end(key)
+        while len(_tts_cache) > TTS_CACHE_MAX:
+            _tts_cache.popitem(last=False)
+    _disk_put(key, data)
+
+def tts_cache_stats():
+    with _tts_cache_lock:
+        return {
+            'entries': len(_tts_cache),
+            'hits': _tts_cache_hits,
+            'misses': _tts_cache_misses,
+            'max_entries': TTS_CACHE_MAX,
+            'ttl': TTS_CACHE_TTL,
+        }
+
+# Map common extended codes to gTTS-compatible codes
+LANG_MAP = {
+    'ja-JP': 'ja',
+    'en-US': 'en',
+    'en-GB': 'en',
+    'zh-CN': 'zh-CN',
+    'zh': 'zh-CN',
+}
+
+def resolve_lang(voice):
+    return LANG_MAP.get(voice, voice) if voice else "ja"
+
+def generate_voice_stream(text, voice=''):
+    """Yield mp3 chunks as gTTS produces them, so playback can start before
+    the full clip is synthesized. Cached clips are served as one chunk."""
+    lang = resolve_lang(voice)
+    key = None
+    if len(text) <= TTS_CACHE_MAX_TEXT_LEN:
+        key = _tts_cache_key(text, lang, 1.0, 1.0)
+        cached = _tts_cache_get(key)
+        if cached is not None:
+            yield cached
+            return
     tts = gTTS(text, lang=lang)
-    tts.write_to_fp(tts_fp)
-    tts_fp.seek(0)
-    # If pitch/speed unchanged, return mp3 BytesIO
-    if pitch == 1.0 and speed == 1.0:
-        tts_fp.seek(0)
-        return tts_fp
-    # Else, process with librosa and pydub
-    audio = AudioSegment.from_file(tts_fp, format='mp3')
+    chunks = []
+    for chunk in tts.stream():
+        chunks.append(chunk)
+        yield chunk
+    if key is not None:
+        _tts_cache_put(key, b''.join(chunks))
+
+# gTTS always emits 24 kHz mp3
+GTTS_SAMPLE_RATE = 24000
+
+def _gtts_bytes(text, lang):
+    """Raw synthesized mp3 for (text, lang), cached at pitch/speed 1.0.
+
+    Caching the unprocessed synthesis separately means a request for the
+    same text at a new pitch/speed skips the Google round-trip and only
+    pays the local filter pass.
+    """
+    key = None
+    if len(text) <= TTS_CACHE_MAX_TEXT_LEN:
+        key = _tts_cache_key(text, lang, 1.0, 1.0)
+        cached = _tts_cache_get(key)
+        if cached is not None:
+            return cached
+    fp = BytesIO()
+    gTTS(text, lang=lang).write_to_fp(fp)
+    data = fp.getvalue()
+    if key is not None:
+        _tts_cache_put(key, data)
+    return data
+
+def _atempo_chain(factor):
+    """ffmpeg's atempo filter accepts 0.5-2.0; chain filters beyond that."""
+    if factor <= 0:
+        raise ValueError(f"tempo factor must be positive, got {factor}")
+    parts = []
+    while factor > 2.0:
+        parts.append('atempo=2.0')
+        factor /= 2.0
+    while factor < 0.5:
+        parts.append('atempo=0.5')
+        factor /= 0.5
+    parts.append(f'atempo={factor:.6f}')
+    return ','.join(parts)
+
+def _ffmpeg_pitch_speed(mp3_bytes, pitch, speed):
+    """Apply pitch/speed in one ffmpeg decode-filter-encode pass.
+
+    Returns processed mp3 bytes, or None if ffmpeg is unavailable or
+    fails. asetrate scales pitch and tempo together, so a trailing atempo
+    divides the pitch factor back out; the pitch factor matches the
+    librosa path's 12*(pitch-1) semitone shift, i.e. 2**(pitch-1).
+    """
+    rate = 2.0 ** (pitch - 1.0)
+    filters = []
+    if pitch != 1.0:
+        filters.append(f'asetrate={int(GTTS_SAMPLE_RATE * rate)}')
+        filters.append(f'aresample={GTTS_SAMPLE_RATE}')
+    tempo = speed / rate
+    if abs(tempo - 1.0) > 1e-6:
+        filters.append(_atempo_chain(tempo))
+    if not filters:
+        return mp3_bytes
+    try:
+        proc = subprocess.run(
+            ['ffmpeg', '-v', 'error', '-i', 'pipe:0',
+             '-af', ','.join(filters), '-f', 'mp3', 'pipe:1'],
+            input=mp3_bytes, capture_output=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if proc.returncode != 0 or not proc.stdout:
+        return None
+    return proc.stdout
+
+def _librosa_pitch_speed(mp3_bytes, pitch, speed):
+    """Fallback pitch/speed pipeline (two STFTs, four codec passes)."""
+    audio = AudioSegment.from_file(BytesIO(mp3_bytes), format='mp3')
     wav_fp = BytesIO()
     audio.export(wav_fp, format='wav')
     wav_fp.seek(0)
-    # Write to temp file, close it, then load with librosa
-    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_wav:
-        tmp_wav.write(wav_fp.read())
-        tmp_wav_path = tmp_wav.name
-    try:
-        y, sr = librosa.load(tmp_wav_path, sr=None)
-        if pitch != 1.0:
-            n_steps = 12 * (pitch - 1.0)
-            y = librosa.effects.pitch_shift(y=y, sr=sr, n_steps=n_steps)
-        if speed != 1.0:
-            y = librosa.effects.time_stretch(y=y, rate=speed)
-        out_wav_fp = BytesIO()
-        sf.write(out_wav_fp, y, sr, format='WAV')
-        out_wav_fp.seek(0)
-        processed_audio = AudioSegment.from_file(out_wav_fp, format='wav')
-        out_mp3_fp = BytesIO()
-        processed_audio.export(out_mp3_fp, format='mp3')
-        out_mp3_fp.seek(0)
-        return out_mp3_fp
-    finally:
-        if os.path.exists(tmp_wav_path):
-            os.remove(tmp_wav_path)
+    y, sr = sf.read(wav_fp, dtype='float32')
+    if y.ndim > 1:
+        y = y.mean(axis=1)
+    if pitch != 1.0:
+        n_steps = 12 * (pitch - 1.0)
+        y = librosa.effects.pitch_shift(y=y, sr=sr, n_steps=n_steps)
+    if speed != 1.0:
+        y = librosa.effects.time_stretch(y=y, rate=speed)
+    out_wav_fp = BytesIO()
+    sf.write(out_wav_fp, y, sr, format='WAV')
+    out_wav_fp.seek(0)
+    processed_audio = AudioSegment.from_file(out_wav_fp, format='wav')
+    out_mp3_fp = BytesIO()
+    processed_audio.export(out_mp3_fp, format='mp3')
+    return out_mp3_fp.getvalue()
+
+def generate_voice(text, pitch=1.0, speed=1.0, voice='', gender='', mood=''):
+    if pitch <= 0 or speed <= 0:
+        raise ValueError("pitch and speed must be positive")
+    lang = resolve_lang(voice)
+    key = None
+    if len(text) <= TTS_CACHE_MAX_TEXT_LEN:
+        key = _tts_cache_key(text, lang, pitch, speed)
+        cached = _tts_cache_get(key)
+        if cached is not None:
+            return BytesIO(cached)
+    # Raw synthesis is cached under (text, lang, 1.0, 1.0) by _gtts_bytes,
+    # so the fast path below needs no extra cache write.
+    mp3_bytes = _gtts_bytes(text, lang)
+    if pitch == 1.0 and speed == 1.0:
+        return BytesIO(mp3_bytes)
+    # Single ffmpeg pass does decode, pitch, tempo, and re-encode together;
+    # the librosa pipeline only runs if ffmpeg is missing or errors out.
+    processed = _ffmpeg_pitch_speed(mp3_bytes, pitch, speed)
+    if processed is None:
+        processed = _librosa_pitch_speed(mp3_bytes, pitch, speed)
+    if key is not None:
+        _tts_cache_put(key, processed)
+    return BytesIO(processed)
@@ -1,17 +1,43 @@
 import os
 import json
+import threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 SETTINGS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../frontend/public/assets/user_settings'))
 os.makedirs(SETTINGS_DIR, exist_ok=True)
 
+# Settings are read on every TTS/settings request but change rarely; keep
+# the parsed dict per username and refresh it on save, so repeat reads are
+# a dict lookup instead of an open+parse.
+_settings_cache = {}
+_settings_cache_lock = threading.Lock()
+
 def get_user_settings(username):
+    with _settings_cache_lock:
+        cached = _settings_cache.get(username)
+    if cached is not None:
+        return cached
     path = os.path.join(SETTINGS_DIR, f'{username}.json')
+    settings = {}
     if os.path.exists(path):
-        with open(path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
+        with open(path, 'rb') as f:
+            data = f.read()
+        settings = orjson.loads(data) if orjson is not None else json.loads(data)
+    with _settings_cache_lock:
+        _settings_cache[username] = settings
+    return settings
 
 def save_user_settings(username, settings):
     path = os.path.join(SETTINGS_DIR, f'{username}.json')
-    with open(path, 'w', encoding='utf-8') as f:
-        json.dump(settings, f)
+    if orjson is not None:
+        payload = orjson.dumps(settings)
+    else:
+        payload = json.dumps(settings).encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(payload)
+    with _settings_cache_lock:
+        _settings_cache[username] = settings
@@ -0,0 +1,18 @@
+"""WSGI entry point for production servers.
+
+Run with one worker so the chat model (and its CUDA context) is loaded
+once and shared across request threads; concurrency comes from threads:
+
+    gunicorn -w 1 --threads 8 -k gthread -b 0.0.0.0:5000 wsgi:app
+
+Do not add --preload: it would import this module (and start the model
+load) in the gunicorn master before forking, and a CUDA context does not
+survive fork.
+"""
+import threading
+
+from main import app, _preload_models
+
+# main.py only preloads when run directly or under the Werkzeug reloader;
+# trigger it here for WSGI servers so the model is warm before traffic.
+threading.Thread(target=_preload_models, daemon=True).start()